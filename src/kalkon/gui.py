@@ -3,9 +3,9 @@
 
 """The kalkon calculator GUI"""
 
-from PySide6.QtCore import QEvent, Qt, Signal
+from PySide6.QtCore import QEvent, Qt, QTimer, Signal
 from PySide6.QtGui import QFont
-from PySide6.QtWidgets import QLabel, QLineEdit, QMainWindow, QTextEdit, QVBoxLayout, QWidget
+from PySide6.QtWidgets import QLabel, QLineEdit, QMainWindow, QPlainTextEdit, QVBoxLayout, QWidget
 
 from .kalkon import Kalkon, ValueFormat, ValueType
 
@@ -17,7 +17,7 @@ margin:0px; border:2px solid rgb(0, 64, 0);
 """
 
 
-class History(QTextEdit):
+class History(QPlainTextEdit):
     """
     The result and history field of the calculator
     """
@@ -30,7 +30,14 @@ class History(QTextEdit):
         self._num_cols = 1
         self.setStyleSheet(WIDGET_STYLESHEET)
         self.setFont(parent.get_font())
+        self._line_height = self.fontMetrics().height()
+        self._char_width = self.fontMetrics().horizontalAdvance("A")
+        self._last_text = None
+        self._lines = []
+        self._lines_key = None
+        self._lines_overflow = False
         self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setFocusPolicy(Qt.NoFocus)
         self._parent.sig_input_field_change.connect(self._input_field_change)
@@ -39,23 +46,42 @@ class History(QTextEdit):
     def resizeEvent(self, new_size):
         """Qt event"""
         super().resizeEvent(new_size)
-        self._num_lines = self.height() // self.fontMetrics().height() - 1
-        self._num_cols = self.width() // self.fontMetrics().horizontalAdvance("A") - 2
+        num_lines = self.height() // self._line_height - 1
+        num_cols = self.width() // self._char_width - 2
+        if (num_lines, num_cols) == (self._num_lines, self._num_cols):
+            return
+        self._num_lines = num_lines
+        self._num_cols = num_cols
         self._update()
 
+    def _get_line(self, index):
+        line_str = self._kalkon.get_expression(index)
+        if line_str:
+            line_str += " = " + self._kalkon.get_result(index)
+        else:
+            line_str = ""
+        if len(line_str) > self._num_cols:
+            line_str = "..."
+        return line_str
+
     def _update(self):
-        box_string = ""
-        for index in range(0, self._num_lines):
-            line_str = self._kalkon.get_expression(index)
-            if line_str:
-                line_str += " = " + self._kalkon.get_result(index)
-            else:
-                line_str = ""
-            if len(line_str) > self._num_cols:
-                line_str = "..."
-            box_string = line_str + "\n" + box_string
-
-        self.setText(box_string)
+        lines_key = (self._kalkon.get_stack_version(), self._num_lines, self._num_cols)
+        if lines_key == self._lines_key and self._lines:
+            # Only the line being typed can have changed
+            self._lines[0] = self._get_line(0)
+            if self._lines_overflow:
+                self._kalkon.report_overflow()
+        else:
+            self._lines = [self._get_line(index) for index in range(self._num_lines)]
+            self._lines_key = lines_key
+            self._lines_overflow = any(
+                self._kalkon.is_overflow(index) for index in range(1, self._num_lines)
+            )
+        box_string = "\n".join(reversed(self._lines)) + "\n"
+
+        if box_string != self._last_text:
+            self._last_text = box_string
+            self.setPlainText(box_string)
 
     def _input_field_change(self, _):
         self._update()
@@ -74,6 +100,10 @@ class InputField(QLineEdit):
         self._parent = parent
         self._kalkon = kalkon
         self._shift_pressed = False
+        self._pending = QTimer(self)
+        self._pending.setSingleShot(True)
+        self._pending.setInterval(0)
+        self._pending.timeout.connect(self._update)
         self.setStyleSheet(WIDGET_STYLESHEET)
         self.textChanged.connect(self._text_changed)
         self.returnPressed.connect(self._enter)
@@ -109,7 +139,10 @@ class InputField(QLineEdit):
         expression = self.text()
         clear = self._kalkon.evaluate(expression, enter)
         if clear:
+            self.blockSignals(True)
             self.setText("")
+            self.blockSignals(False)
+            self._kalkon.evaluate("")
         self._parent.sig_input_field_change.emit(expression)
         status_str = self._kalkon.get_status()
         if status_str:
@@ -119,12 +152,13 @@ class InputField(QLineEdit):
         self._parent.sig_update_control.emit()
 
     def _enter(self):
+        self._pending.stop()
         self._update(True)
         if self._kalkon.is_stack_updated() and not self._kalkon.is_error():
             self._parent.sig_stack_updated.emit()
 
     def _text_changed(self):
-        self._update(False)
+        self._pending.start()
 
 
 class CentralWidget(QWidget):
@@ -3,9 +3,11 @@
 
 """The kalkon calculator class"""
 
+import ast
+import math
 import struct
+from collections import deque
 from enum import Enum, auto
-from functools import partial
 
 from asteval import Interpreter
 
@@ -34,10 +36,78 @@ class ValueFormat(Enum):
     BINARY = auto()
 
 
+_WIDTH_BITS = {
+    ValueType.INT8: 8,
+    ValueType.INT16: 16,
+    ValueType.INT32: 32,
+    ValueType.INT64: 64,
+    ValueType.UINT8: 8,
+    ValueType.UINT16: 16,
+    ValueType.UINT32: 32,
+    ValueType.UINT64: 64,
+}
+
+_SIGNED_TYPES = frozenset({ValueType.INT8, ValueType.INT16, ValueType.INT32, ValueType.INT64})
+
+_FLOAT_TYPES = frozenset({ValueType.FLOAT, ValueType.F32})
+
+_INT_FORMATTERS = {
+    ValueFormat.DECIMAL: str,
+    ValueFormat.HEXADECIMAL: hex,
+    ValueFormat.BINARY: bin,
+}
+
+
+def _fits_int64(int_value):
+    """Return True if int_value fits in a signed 64 bit integer"""
+    return -(1 << 63) <= int_value < (1 << 63)
+
+
+def _f32_bits(value):
+    """Return the IEEE-754 single precision bit pattern of value"""
+    return struct.unpack("I", struct.pack("f", value))[0]
+
+
+def _parse_literal(expression):
+    """Return the value of a plain integer or float literal, None for anything else"""
+    if not expression.isascii() or expression[0].isspace():
+        return None
+    try:
+        return int(expression, 0)
+    except ValueError:
+        pass
+    # Only real float literals, leave '017', 'inf' and 'nan' to the interpreter
+    if "." not in expression and "e" not in expression.lower():
+        return None
+    try:
+        return float(expression)
+    except ValueError:
+        return None
+
+
 class Kalkon:
     """The kalkon calculator class"""
 
+    __slots__ = (
+        "_ast_cache",
+        "_cmd_dict",
+        "_error",
+        "_fmt_cache",
+        "_format",
+        "_interpreter",
+        "_last_expr",
+        "_last_return",
+        "_stack",
+        "_stack_updated",
+        "_stack_version",
+        "_status",
+        "_type",
+        "_valid_cache",
+        "_validator",
+    )
+
     STACK_DEPTH = 5
+    CACHE_SIZE = 256
 
     def __init__(self):
         super().__init__()
@@ -47,19 +117,50 @@ class Kalkon:
         self._status = ""
         self._error = False
         self._stack_updated = False
+        self._stack_version = 0
         self._interpreter = Interpreter(
             use_numpy=False,
             minimal=True,
         )
+        self._validator = Interpreter(
+            use_numpy=False,
+            minimal=True,
+        )
+        self._ast_cache = {}
+        self._valid_cache = {}
+        self._fmt_cache = {}
+        self._cmd_dict = {
+            ":float": (self._set_type, ValueType.FLOAT),
+            ":dec": (self._set_format, ValueFormat.DECIMAL),
+            ":hex": (self._set_format, ValueFormat.HEXADECIMAL),
+            ":bin": (self._set_format, ValueFormat.BINARY),
+            ":f32": (self._set_type, ValueType.F32),
+            ":int": (self._set_type, ValueType.INT),
+            ":i8": (self._set_type, ValueType.INT8),
+            ":i16": (self._set_type, ValueType.INT16),
+            ":i32": (self._set_type, ValueType.INT32),
+            ":i64": (self._set_type, ValueType.INT64),
+            ":u8": (self._set_type, ValueType.UINT8),
+            ":u16": (self._set_type, ValueType.UINT16),
+            ":u32": (self._set_type, ValueType.UINT32),
+            ":u64": (self._set_type, ValueType.UINT64),
+            ":clear": (self.clear, None),
+        }
+        self._last_expr = None
+        self._last_return = False
         self.clear()
 
     def _set_type(self, value_type):
+        self._last_expr = None
+        self._stack_version += 1
         if value_type == ValueType.FLOAT and self._format == ValueFormat.BINARY:
             self._status = "No binary representation for float"
         else:
             self._type = value_type
 
     def _set_format(self, value_format):
+        self._last_expr = None
+        self._stack_version += 1
         if self._type == ValueType.FLOAT and value_format == ValueFormat.BINARY:
             self._status = "No binary representation for float"
         else:
@@ -75,8 +176,10 @@ class Kalkon:
 
     def clear(self):
         """Clear history"""
-        self._stack = []
+        self._stack = deque()
         self._stack_updated = True
+        self._stack_version += 1
+        self._last_expr = None
 
     def is_error(self):
         """Is the current field an error?"""
@@ -88,64 +191,49 @@ class Kalkon:
         self._stack_updated = False
         return stack_updated
 
+    def get_stack_version(self):
+        """Return stack version, changed whenever the history lines change"""
+        return self._stack_version
+
     def get_status(self):
         """Return status"""
         return self._status
 
     def _is_signed_type(self):
-        if self._type in [ValueType.INT8, ValueType.INT16, ValueType.INT32, ValueType.INT64]:
-            return True
-        return False
+        return self._type in _SIGNED_TYPES
 
     def _get_typed_result(self, value):
         if self._type == ValueType.INT:
             return int(value)
-        if self._type in [ValueType.F32, ValueType.FLOAT, ValueType.INT]:
+        bits = _WIDTH_BITS.get(self._type)
+        if bits is None:
             return value
-        signed = self._is_signed_type()
         int_value = int(value)
-        try:
-            value_bytes = int_value.to_bytes(8, "little", signed=True)
-        except OverflowError:
-            self._status = "Input overflow"
+        if not _fits_int64(int_value):
+            self.report_overflow()
             return None
-        width = 1
-        if self._type in [ValueType.INT8, ValueType.UINT8]:
-            width = 1
-        elif self._type in [ValueType.INT16, ValueType.UINT16]:
-            width = 2
-        elif self._type in [ValueType.INT32, ValueType.UINT32]:
-            width = 4
-        elif self._type in [ValueType.INT64, ValueType.UINT64]:
-            width = 8
-        return int.from_bytes(value_bytes[0:width], "little", signed=signed)
+        int_value &= (1 << bits) - 1
+        if self._is_signed_type() and int_value >> (bits - 1):
+            int_value -= 1 << bits
+        return int_value
 
     def _get_formatted_result(self, value):
-        result_str = ""
         if value is None:
-            result_str = ""
-        elif self._format == ValueFormat.BINARY:
-            if self._type == ValueType.FLOAT:
-                result_str = ""
-            elif self._type == ValueType.F32:
-                value_bytes = struct.pack("f", value)
-                value = int.from_bytes(value_bytes[0:4], "little")
-                result_str = f"{bin(value)}"
-            else:
-                result_str = bin(value)
+            return ""
+        if self._type not in _FLOAT_TYPES:
+            return _INT_FORMATTERS[self._format](value)
+        result_str = ""
+        if self._format == ValueFormat.BINARY:
+            if self._type == ValueType.F32:
+                result_str = bin(_f32_bits(value))
         elif self._format == ValueFormat.HEXADECIMAL:
             if self._type == ValueType.FLOAT:
                 result_str = float.hex(float(value))
-            elif self._type == ValueType.F32:
-                value_bytes = struct.pack("f", value)
-                value = int.from_bytes(value_bytes[0:4], "little")
-                result_str = hex(value)
             else:
-                result_str = hex(value)
+                result_str = hex(_f32_bits(value))
         else:
             if self._type == ValueType.F32:
-                value_bytes = struct.pack("f", value)
-                value = struct.unpack("f", value_bytes)[0]
+                value = struct.unpack("f", struct.pack("f", value))[0]
             result_str = str(value)
         return result_str
 
@@ -156,9 +244,33 @@ class Kalkon:
         value = self._stack[index][1]
         if value is None:
             return ""
-        value = self._get_typed_result(value)
-        value = self._get_formatted_result(value)
-        return value
+        value_type = type(value)
+        if value_type not in (int, float):
+            # Signed zeros inside complex values and containers compare equal
+            return self._get_formatted_result(self._get_typed_result(value))
+        # 0.0 and -0.0 compare equal, so the sign must be part of the key
+        sign = math.copysign(1.0, value) if value_type is float else None
+        key = (value_type, value, sign, self._type, self._format)
+        result = self._fmt_cache.get(key)
+        if result is not None:
+            return result
+        typed_value = self._get_typed_result(value)
+        if typed_value is None:
+            return ""
+        return self._cache_store(self._fmt_cache, key, self._get_formatted_result(typed_value))
+
+    def is_overflow(self, index=0):
+        """Does the result overflow the current type?"""
+        if index >= len(self._stack):
+            return False
+        value = self._stack[index][1]
+        if value is None or self._type not in _WIDTH_BITS:
+            return False
+        return not _fits_int64(int(value))
+
+    def report_overflow(self):
+        """Report input overflow in the status"""
+        self._status = "Input overflow"
 
     def get_expression(self, index=0):
         """Return expression"""
@@ -167,18 +279,23 @@ class Kalkon:
         return self._stack[index][0]
 
     def _push(self, expression, result):
-        self._stack[0] = (None, None)
-        self._stack.insert(1, (expression, result))
+        if self._stack:
+            self._stack.popleft()
+        self._stack.appendleft((expression, result))
+        self._stack.appendleft((None, None))
         self._stack_updated = True
+        self._stack_version += 1
 
     def pop(self):
         """Pop item from stack"""
+        self._last_expr = None
         expression = ""
         if len(self._stack) > 1:
             (expression, _) = self._stack[1]
         if len(self._stack) > 0:
-            self._stack.pop(0)
+            self._stack.popleft()
             self._stack_updated = True
+            self._stack_version += 1
         if len(self._stack) > 0:
             self._stack[0] = (None, None)
         return expression
@@ -191,52 +308,69 @@ class Kalkon:
         self._stack_updated = True
 
     def _process_command(self, expression, enter):
-        _cmd_dict = {
-            ":float": partial(self._set_type, ValueType.FLOAT),
-            ":dec": partial(self._set_format, ValueFormat.DECIMAL),
-            ":hex": partial(self._set_format, ValueFormat.HEXADECIMAL),
-            ":bin": partial(self._set_format, ValueFormat.BINARY),
-            ":f32": partial(self._set_type, ValueType.F32),
-            ":int": partial(self._set_type, ValueType.INT),
-            ":i8": partial(self._set_type, ValueType.INT8),
-            ":i16": partial(self._set_type, ValueType.INT16),
-            ":i32": partial(self._set_type, ValueType.INT32),
-            ":i64": partial(self._set_type, ValueType.INT64),
-            ":u8": partial(self._set_type, ValueType.UINT8),
-            ":u16": partial(self._set_type, ValueType.UINT16),
-            ":u32": partial(self._set_type, ValueType.UINT32),
-            ":u64": partial(self._set_type, ValueType.UINT64),
-            ":clear": self.clear,
-        }
-        if not expression.startswith(":"):
+        if not expression or expression[0] != ":":
             return False
 
-        if expression in _cmd_dict and enter:
-            _cmd_dict[expression]()
+        if expression not in self._cmd_dict:
+            self._status = f"Unknown command '{expression}'"
             return True
-        if expression in _cmd_dict:
-            self._status = f"CMD: {expression}"
+        if enter:
+            (function, argument) = self._cmd_dict[expression]
+            if argument is None:
+                function()
+            else:
+                function(argument)
             return True
-
-        self._status = f"Unknown command '{expression}'"
+        self._status = f"CMD: {expression}"
         return True
 
+    def _cache_store(self, cache, key, value):
+        if len(cache) >= self.CACHE_SIZE:
+            del cache[next(iter(cache))]
+        cache[key] = value
+        return value
+
     def _validate_set_variable(self, expression):
         if "==" in expression:
             return False
         if "=" not in expression:
             return False
-        validator = Interpreter(
-            use_numpy=False,
-            minimal=True,
-        )
-        validator(expression, show_errors=False, raise_errors=False)
-        if len(validator.error) > 0:
-            return False
-        return True
+        valid = self._valid_cache.get(expression)
+        if valid is not None:
+            return valid
+        self._validator.error = []
+        try:
+            node = self._validator.parse(expression)
+        except (SyntaxError, RuntimeError):
+            return self._cache_store(self._valid_cache, expression, False)
+        valid = len(node.body) == 1 and isinstance(node.body[0], ast.Assign)
+        return self._cache_store(self._valid_cache, expression, valid)
+
+    def _interpret(self, expression):
+        interpreter = self._interpreter
+        interpreter.error = []
+        literal = _parse_literal(expression)
+        if literal is not None:
+            return literal
+        node = self._ast_cache.get(expression)
+        if node is None:
+            try:
+                node = interpreter.parse(expression)
+            except (SyntaxError, RuntimeError):
+                return None
+            self._cache_store(self._ast_cache, expression, node)
+        return interpreter.run(node, expr=expression, with_raise=False)
 
     def evaluate(self, expression, enter=False):
         """Evaluate expression"""
+        if not enter and expression == self._last_expr and not self._error:
+            return self._last_return
+        result = self._evaluate(expression, enter)
+        self._last_expr = None if enter else expression
+        self._last_return = result
+        return result
+
+    def _evaluate(self, expression, enter):
         self._status = ""
         self._error = False
 
@@ -257,12 +391,17 @@ class Kalkon:
         if self._validate_set_variable(expression):
             self._status = f"Set {expression}"
             if enter:
+                self._interpret(expression)
+                errors = self._interpreter.error
+                if errors:
+                    self._status = errors[0].get_error()[1]
+                    self._error = True
+                    return False
                 self._set(None, None)
-                self._interpreter(expression, show_errors=False, raise_errors=False)
                 return True
             return False
 
-        result = self._interpreter(expression, show_errors=False, raise_errors=False)
+        result = self._interpret(expression)
         if result is not None and ("<built-in function" in str(result) or "<class" in str(result)):
             result = ""
             return False
@@ -271,13 +410,14 @@ class Kalkon:
             self._status = "Strings are not supported"
             return False
 
-        if len(self._interpreter.error) == 0:
+        errors = self._interpreter.error
+        if not errors:
             if enter:
                 self._push(expression, result)
                 return True
             self._set(expression, result)
         else:
-            self._status = self._interpreter.error[0].get_error()[1]
+            self._status = errors[0].get_error()[1]
             self._error = True
 
         return False